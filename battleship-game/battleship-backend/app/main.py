@@ -1,15 +1,26 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Tuple
+from cachetools import LRUCache
+from dataclasses import dataclass, field
+from contextlib import asynccontextmanager
+from typing import List, Optional, Dict, Iterator, Set, Tuple
+import asyncio
+import itertools
 import random
 import uuid
-import json
+import orjson
 import os
+import logging
+import tempfile
 from pathlib import Path
 from enum import Enum
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Disable CORS. Do not remove this for full-stack development.
 app.add_middleware(
@@ -20,6 +31,9 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Board state responses are repetitive JSON and compress well
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
 class CellState(str, Enum):
     EMPTY = "empty"
     SHIP = "ship"
@@ -33,88 +47,283 @@ class GameState(str, Enum):
     PLAYER_WON = "player_won"
     AI_WON = "ai_won"
 
-class Ship(BaseModel):
+# Game state is plain dataclasses; only request bodies go through Pydantic validation
+
+@dataclass(slots=True)
+class Ship:
     size: int
     positions: List[Tuple[int, int]]
     hits: int = 0
     
     def is_sunk(self) -> bool:
         return self.hits >= self.size
+    
+    def to_dict(self) -> Dict:
+        return {"size": self.size, "positions": self.positions, "hits": self.hits}
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Ship":
+        return cls(size=data['size'], positions=[(x, y) for x, y in data['positions']], hits=data['hits'])
+
+def cell_bit(x: int, y: int) -> int:
+    return 1 << (x * 10 + y)
+
+ALL_CELLS: List[Tuple[int, int]] = [(x, y) for x in range(10) for y in range(10)]
+FULL_MASK = (1 << 100) - 1
+NEIGHBOR_OFFSETS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+# In-bounds orthogonal neighbours of every cell, in NEIGHBOR_OFFSETS order
+CELL_NEIGHBORS: Dict[Tuple[int, int], List[Tuple[int, int]]] = {
+    (x, y): [(x + dx, y + dy) for dx, dy in NEIGHBOR_OFFSETS if 0 <= x + dx < 10 and 0 <= y + dy < 10]
+    for x, y in ALL_CELLS
+}
+
+# CellState for each combination of a cell's bits, indexed by ship | hit << 1 | miss << 2
+CELL_STATE_BY_BITS = (
+    CellState.EMPTY, CellState.SHIP, CellState.HIT, CellState.HIT,
+    CellState.MISS, CellState.MISS, CellState.HIT, CellState.HIT,
+)
+
+# One-character cell encoding used for grid rows in save files
+CELL_CHARS = {CellState.EMPTY: '.', CellState.SHIP: 'S', CellState.HIT: 'H', CellState.MISS: 'M'}
+CELL_STATE_BY_CHAR = {char: cell for cell, char in CELL_CHARS.items()}
 
-class Board(BaseModel):
-    grid: List[List[CellState]]
-    ships: List[Ship]
+def iter_cells(mask: int) -> Iterator[Tuple[int, int]]:
+    """Yield the (x, y) cells set in a bitboard, in ascending bit order."""
+    while mask:
+        low = mask & -mask
+        yield divmod(low.bit_length() - 1, 10)
+        mask ^= low
+
+@dataclass(slots=True)
+class Board:
+    # 100-bit bitboards, cell (x, y) is bit x * 10 + y. Hit cells keep their ship bit.
+    ship_mask: int = 0
+    hit_mask: int = 0
+    miss_mask: int = 0
+    ships: List[Ship] = field(default_factory=list)
+    # Cell -> ship occupying it; not persisted, rebuilt by add_ship() on load
+    _cell_to_ship: Dict[Tuple[int, int], Ship] = field(default_factory=dict, init=False, repr=False)
+    _ships_alive: int = field(default=0, init=False, repr=False)
+    # reveal_ships -> (masks the grid was rendered from, grid); reused until the masks change
+    _grid_cache: Dict[bool, Tuple[Tuple[int, int, int], List[List[CellState]]]] = field(default_factory=dict, init=False, repr=False)
+    
+    @property
+    def ships_alive(self) -> int:
+        return self._ships_alive
+    
+    def add_ship(self, ship: Ship):
+        self.ships.append(ship)
+        for x, y in ship.positions:
+            self.ship_mask |= cell_bit(x, y)
+            self._cell_to_ship[(x, y)] = ship
+        if not ship.is_sunk():
+            self._ships_alive += 1
+    
+    def hit_ship(self, ship: Ship):
+        ship.hits += 1
+        if ship.hits == ship.size:
+            self._ships_alive -= 1
+    
+    def ship_at(self, x: int, y: int) -> Optional[Ship]:
+        return self._cell_to_ship.get((x, y))
+    
+    def cell_state(self, x: int, y: int) -> CellState:
+        bit = cell_bit(x, y)
+        if self.hit_mask & bit:
+            return CellState.HIT
+        if self.miss_mask & bit:
+            return CellState.MISS
+        if self.ship_mask & bit:
+            return CellState.SHIP
+        return CellState.EMPTY
     
-    def __init__(self):
-        super().__init__(grid=[[CellState.EMPTY for _ in range(10)] for _ in range(10)], ships=[])
-
-class Game(BaseModel):
-    id: str
-    player_board: Board
-    ai_board: Board
-    state: GameState
-    current_turn: str  # "player" or "ai"
+    def is_attacked(self, x: int, y: int) -> bool:
+        return bool((self.hit_mask | self.miss_mask) & cell_bit(x, y))
     
-    def __init__(self):
-        super().__init__(
-            id=str(uuid.uuid4()),
-            player_board=Board(),
-            ai_board=Board(),
-            state=GameState.SETUP,
-            current_turn="player"
+    def to_grid(self, reveal_ships: bool = True) -> List[List[CellState]]:
+        """Render the board as a 10x10 grid. The result is cached and must not be mutated."""
+        masks = (self.ship_mask, self.hit_mask, self.miss_mask)
+        cached = self._grid_cache.get(reveal_ships)
+        if cached and cached[0] == masks:
+            return cached[1]
+        
+        ship_mask = self.ship_mask if reveal_ships else 0
+        hit_mask, miss_mask = self.hit_mask, self.miss_mask
+        grid = [
+            [CELL_STATE_BY_BITS[(ship_mask >> i & 1) | (hit_mask >> i & 1) << 1 | (miss_mask >> i & 1) << 2]
+             for i in range(row_start, row_start + 10)]
+            for row_start in range(0, 100, 10)
+        ]
+        self._grid_cache[reveal_ships] = (masks, grid)
+        return grid
+    
+    def to_dict(self) -> Dict:
+        return {
+            "grid": [''.join(CELL_CHARS[cell] for cell in row) for row in self.to_grid()],
+            "ships": [ship.to_dict() for ship in self.ships]
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Board":
+        board = cls()
+        for x, row in enumerate(data['grid']):
+            # Older saves stored each row as a list of CellState values
+            cells = [CELL_STATE_BY_CHAR[char] for char in row] if isinstance(row, str) else [CellState(cell) for cell in row]
+            for y, cell in enumerate(cells):
+                if cell == CellState.HIT:
+                    board.hit_mask |= cell_bit(x, y)
+                elif cell == CellState.MISS:
+                    board.miss_mask |= cell_bit(x, y)
+        for ship_data in data['ships']:
+            board.add_ship(Ship.from_dict(ship_data))
+        return board
+
+@dataclass(slots=True)
+class Game:
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    player_board: Board = field(default_factory=Board)
+    ai_board: Board = field(default_factory=Board)
+    state: GameState = GameState.SETUP
+    current_turn: str = "player"  # "player" or "ai"
+    
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "player_board": self.player_board.to_dict(),
+            "ai_board": self.ai_board.to_dict(),
+            "state": self.state,
+            "current_turn": self.current_turn
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Game":
+        return cls(
+            id=data['id'],
+            player_board=Board.from_dict(data['player_board']),
+            ai_board=Board.from_dict(data['ai_board']),
+            state=GameState(data['state']),
+            current_turn=data['current_turn']
         )
 
-games: Dict[str, Game] = {}
+# Most recently used games kept in memory; the rest are reloaded from disk on demand
+GAMES_CACHE_SIZE = int(os.getenv("GAMES_CACHE_SIZE", "1024"))
+games: LRUCache = LRUCache(maxsize=GAMES_CACHE_SIZE)
 
 GAMES_DATA_DIR = Path("data/games")
 GAMES_DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-def save_game(game: Game):
+# Games modified since they were last written to disk. Request handlers only
+# mark games dirty; a background task writes them out every few seconds. Holding
+# the game here keeps unsaved changes alive even if it is evicted from the cache.
+dirty_games: Dict[str, Game] = {}
+# Games taken from dirty_games whose write to disk hasn't finished yet
+flushing_games: Dict[str, Game] = {}
+FLUSH_INTERVAL_SECONDS = 2.0
+flush_task: Optional[asyncio.Task] = None
+flush_stop: Optional[asyncio.Event] = None
+
+def write_game_file(game_id: str, data: bytes):
+    tmp_path = None
     try:
-        game_file = GAMES_DATA_DIR / f"{game.id}.json"
-        with open(game_file, 'w') as f:
-            json.dump(game.model_dump(), f)
+        game_file = GAMES_DATA_DIR / f"{game_id}.json"
+        # Write to a uniquely named temp file and rename it over the old save, so a
+        # crash or an overlapping write of the same game never leaves a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=GAMES_DATA_DIR, prefix=f"{game_id}.", suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, game_file)
     except Exception as e:
-        print(f"Error saving game {game.id}: {e}")
+        logger.error("Error saving game %s: %s", game_id, e)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def serialize_game(game: Game) -> bytes:
+    return orjson.dumps(game.to_dict())
+
+# Per-game locks serializing read-modify-write of a game across awaits. A lock
+# lives only while some request holds or waits on it. Handlers call find_game()
+# after acquiring it, so they work on the current instance even if the game was
+# evicted and reloaded while they waited.
+game_locks: Dict[str, asyncio.Lock] = {}
+game_lock_users: Dict[str, int] = {}
+
+@asynccontextmanager
+async def game_lock(game_id: str):
+    lock = game_locks.get(game_id)
+    if lock is None:
+        lock = game_locks[game_id] = asyncio.Lock()
+    game_lock_users[game_id] = game_lock_users.get(game_id, 0) + 1
+    try:
+        async with lock:
+            yield
+    finally:
+        game_lock_users[game_id] -= 1
+        if not game_lock_users[game_id]:
+            del game_lock_users[game_id]
+            del game_locks[game_id]
+
+def mark_game_dirty(game: Game):
+    dirty_games[game.id] = game
+
+async def flush_dirty_games():
+    while dirty_games:
+        game_id, game = dirty_games.popitem()
+        flushing_games[game_id] = game
+        try:
+            # Serialize on the event loop, under the game's lock, so handlers can't mutate it mid-dump
+            async with game_lock(game_id):
+                data = serialize_game(game)
+            await asyncio.to_thread(write_game_file, game_id, data)
+        finally:
+            if flushing_games.get(game_id) is game:
+                del flushing_games[game_id]
+
+async def flush_loop(stop: asyncio.Event):
+    # Runs one last flush after stop is set; never cancelled, so no write is cut off midway
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=FLUSH_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        await flush_dirty_games()
 
 def load_game(game_id: str) -> Optional[Game]:
     try:
         game_file = GAMES_DATA_DIR / f"{game_id}.json"
         if game_file.exists():
-            with open(game_file, 'r') as f:
-                game_data = json.load(f)
-                game = Game()
-                game.id = game_data['id']
-                
-                player_board = Board()
-                player_board.grid = [[CellState(cell) for cell in row] for row in game_data['player_board']['grid']]
-                player_board.ships = [Ship(**ship_data) for ship_data in game_data['player_board']['ships']]
-                game.player_board = player_board
-                
-                ai_board = Board()
-                ai_board.grid = [[CellState(cell) for cell in row] for row in game_data['ai_board']['grid']]
-                ai_board.ships = [Ship(**ship_data) for ship_data in game_data['ai_board']['ships']]
-                game.ai_board = ai_board
-                
-                game.state = GameState(game_data['state'])
-                game.current_turn = game_data['current_turn']
-                return game
+            with open(game_file, 'rb') as f:
+                return Game.from_dict(orjson.loads(f.read()))
     except Exception as e:
-        print(f"Error loading game {game_id}: {e}")
+        logger.error("Error loading game %s: %s", game_id, e)
     return None
 
-def load_all_games():
-    try:
-        for game_file in GAMES_DATA_DIR.glob("*.json"):
-            game_id = game_file.stem
+# Games are loaded from disk on first access; only their ids are read at startup
+known_game_ids: Set[str] = {game_file.stem for game_file in GAMES_DATA_DIR.glob("*.json")}
+
+def find_game(game_id: str) -> Optional[Game]:
+    game = games.get(game_id)
+    if game is None:
+        # An evicted game with unsaved or still-being-written changes is newer than its file on disk
+        game = dirty_games.get(game_id) or flushing_games.get(game_id)
+        if game is None and game_id in known_game_ids:
             game = load_game(game_id)
-            if game:
-                games[game_id] = game
-        print(f"Loaded {len(games)} games from disk")
-    except Exception as e:
-        print(f"Error loading games: {e}")
+        if game:
+            games[game_id] = game
+    return game
+
+@app.on_event("startup")
+async def start_flush_loop():
+    global flush_task, flush_stop
+    flush_stop = asyncio.Event()
+    flush_task = asyncio.create_task(flush_loop(flush_stop))
 
-load_all_games()
+@app.on_event("shutdown")
+async def stop_flush_loop():
+    if flush_task:
+        flush_stop.set()
+        await flush_task
+    else:
+        await flush_dirty_games()
 
 class PlaceShipRequest(BaseModel):
     positions: List[Tuple[int, int]]
@@ -124,109 +333,94 @@ class AttackRequest(BaseModel):
     y: int
 
 def is_valid_ship_placement(board: Board, positions: List[Tuple[int, int]], size: int) -> bool:
-    if len(positions) != size:
+    if len(positions) != size or len(set(positions)) != size:
         return False
     
-    for x, y in positions:
-        if x < 0 or x >= 10 or y < 0 or y >= 10:
-            return False
+    xs = [x for x, _ in positions]
+    ys = [y for _, y in positions]
+    min_x, max_x, min_y, max_y = min(xs), max(xs), min(ys), max(ys)
+    if min_x < 0 or max_x >= 10 or min_y < 0 or max_y >= 10:
+        return False
     
-    positions.sort()
-    if len(positions) > 1:
-        horizontal = all(positions[i][0] == positions[0][0] and positions[i][1] == positions[i-1][1] + 1 
-                        for i in range(1, len(positions)))
-        vertical = all(positions[i][1] == positions[0][1] and positions[i][0] == positions[i-1][0] + 1 
-                      for i in range(1, len(positions)))
-        if not (horizontal or vertical):
-            return False
+    # Distinct cells spanning exactly size cells along one axis form a straight, gapless ship
+    if (max_x - min_x, max_y - min_y) not in ((0, size - 1), (size - 1, 0)):
+        return False
     
+    ship_mask = 0
     for x, y in positions:
-        if board.grid[x][y] != CellState.EMPTY:
-            return False
-    
-    return True
+        ship_mask |= cell_bit(x, y)
+    return not ship_mask & (board.ship_mask | board.hit_mask | board.miss_mask)
+
+SHIP_SIZES = [5, 4, 3, 3, 2]
+
+def ship_placements(size: int) -> List[Tuple[int, Tuple[Tuple[int, int], ...]]]:
+    """Every in-bounds horizontal and vertical placement of a ship as (mask, positions)."""
+    placements = []
+    for x, y in ALL_CELLS:
+        if y + size <= 10:
+            placements.append(tuple((x, y + i) for i in range(size)))
+        if x + size <= 10:
+            placements.append(tuple((x + i, y) for i in range(size)))
+    return [(sum(cell_bit(px, py) for px, py in positions), positions) for positions in placements]
+
+SHIP_PLACEMENTS = {size: ship_placements(size) for size in set(SHIP_SIZES)}
 
 def place_ship_on_board(board: Board, positions: List[Tuple[int, int]], size: int):
-    ship = Ship(size=size, positions=positions)
-    board.ships.append(ship)
-    for x, y in positions:
-        board.grid[x][y] = CellState.SHIP
+    board.add_ship(Ship(size=size, positions=positions))
 
 def generate_ai_ships(board: Board):
-    ship_sizes = [5, 4, 3, 3, 2]
-    
-    for size in ship_sizes:
-        placed = False
-        attempts = 0
-        while not placed and attempts < 100:
-            horizontal = random.choice([True, False])
-            
-            if horizontal:
-                x = random.randint(0, 9)
-                y = random.randint(0, 10 - size)
-                positions = [(x, y + i) for i in range(size)]
-            else:
-                x = random.randint(0, 10 - size)
-                y = random.randint(0, 9)
-                positions = [(x + i, y) for i in range(size)]
-            
-            if is_valid_ship_placement(board, positions, size):
-                place_ship_on_board(board, positions, size)
-                placed = True
-            
-            attempts += 1
+    for size in SHIP_SIZES:
+        candidates = [placement for placement in SHIP_PLACEMENTS[size] if not placement[0] & board.ship_mask]
+        if candidates:
+            _, positions = random.choice(candidates)
+            place_ship_on_board(board, list(positions), size)
 
 def make_ai_move(game: Game) -> Tuple[int, int]:
-    print(f"DEBUG: make_ai_move called for game {game.id}")
     board = game.player_board
     
-    print(f"DEBUG: Player board state:")
-    for i, row in enumerate(board.grid):
-        print(f"DEBUG: Row {i}: {[cell.value for cell in row]}")
+    # Expanding the grid is expensive, so only do it when debug logging is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("make_ai_move called for game %s, player board state:", game.id)
+        for i, row in enumerate(board.to_grid()):
+            logger.debug("Row %d: %s", i, [cell.value for cell in row])
     
-    for x in range(10):
-        for y in range(10):
-            if board.grid[x][y] == CellState.HIT:
-                print(f"DEBUG: Found HIT at ({x}, {y}), looking for adjacent targets")
-                for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-                    nx, ny = x + dx, y + dy
-                    if 0 <= nx < 10 and 0 <= ny < 10:
-                        if board.grid[nx][ny] == CellState.EMPTY or board.grid[nx][ny] == CellState.SHIP:
-                            print(f"DEBUG: AI targeting adjacent cell ({nx}, {ny})")
-                            return nx, ny
+    attacked_mask = board.hit_mask | board.miss_mask
+    for x, y in iter_cells(board.hit_mask):
+        logger.debug("Found HIT at (%d, %d), looking for adjacent targets", x, y)
+        for nx, ny in CELL_NEIGHBORS[(x, y)]:
+            if not attacked_mask & cell_bit(nx, ny):
+                logger.debug("AI targeting adjacent cell (%d, %d)", nx, ny)
+                return nx, ny
     
-    available_cells = []
-    for x in range(10):
-        for y in range(10):
-            if board.grid[x][y] in [CellState.EMPTY, CellState.SHIP]:
-                available_cells.append((x, y))
-    
-    print(f"DEBUG: Available cells for random attack: {len(available_cells)}")
-    if available_cells:
-        target = random.choice(available_cells)
-        print(f"DEBUG: AI choosing random target: {target}")
+    free_mask = FULL_MASK & ~attacked_mask
+    free_count = free_mask.bit_count()
+    logger.debug("Available cells for random attack: %d", free_count)
+    if free_count:
+        target = next(itertools.islice(iter_cells(free_mask), random.randrange(free_count), None))
+        logger.debug("AI choosing random target: %s", target)
         return target
     
-    print(f"DEBUG: WARNING - No available cells found, using fallback (0, 0)")
+    logger.warning("No available cells found for game %s, using fallback (0, 0)", game.id)
     return 0, 0  # Fallback
 
 def process_attack(board: Board, x: int, y: int) -> Dict:
-    if board.grid[x][y] == CellState.SHIP:
-        board.grid[x][y] = CellState.HIT
+    bit = cell_bit(x, y)
+    if board.ship_mask & bit:
+        board.hit_mask |= bit
         
-        for ship in board.ships:
-            if (x, y) in ship.positions:
-                ship.hits += 1
-                sunk = ship.is_sunk()
-                return {"hit": True, "sunk": sunk}
+        ship = board.ship_at(x, y)
+        if ship:
+            board.hit_ship(ship)
+            sunk = ship.is_sunk()
+            return {"hit": True, "sunk": sunk}
         
         return {"hit": True, "sunk": False}
     else:
-        board.grid[x][y] = CellState.MISS
+        board.miss_mask |= bit
         return {"hit": False, "sunk": False}
 
 def check_game_over(board: Board) -> bool:
-    return all(ship.is_sunk() for ship in board.ships)
+    return board.ships_alive == 0
 
 @app.get("/healthz")
 async def healthz():
@@ -237,167 +431,137 @@ async def create_new_game():
     game = Game()
     generate_ai_ships(game.ai_board)
     games[game.id] = game
-    save_game(game)
+    known_game_ids.add(game.id)
+    mark_game_dirty(game)
     return {"game_id": game.id, "state": game.state}
 
 @app.get("/game/{game_id}")
 async def get_game(game_id: str):
-    if game_id not in games:
-        game = load_game(game_id)
-        if game:
-            games[game_id] = game
-        else:
-            raise HTTPException(status_code=404, detail="Game not found")
-    
-    game = games[game_id]
-    
-    ai_grid = []
-    for row in game.ai_board.grid:
-        ai_row = []
-        for cell in row:
-            if cell == CellState.SHIP:
-                ai_row.append(CellState.EMPTY)  # Hide AI ships
-            else:
-                ai_row.append(cell)
-        ai_grid.append(ai_row)
+    game = find_game(game_id)
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
     
     return {
         "id": game.id,
         "state": game.state,
         "current_turn": game.current_turn,
-        "player_board": game.player_board.grid,
-        "ai_board": ai_grid,
-        "player_ships_remaining": len([s for s in game.player_board.ships if not s.is_sunk()]),
-        "ai_ships_remaining": len([s for s in game.ai_board.ships if not s.is_sunk()])
+        "player_board": game.player_board.to_grid(),
+        "ai_board": game.ai_board.to_grid(reveal_ships=False),  # Hide AI ships
+        "player_ships_remaining": game.player_board.ships_alive,
+        "ai_ships_remaining": game.ai_board.ships_alive
     }
 
 @app.post("/game/{game_id}/place-ship")
 async def place_ship(game_id: str, request: PlaceShipRequest):
-    if game_id not in games:
-        game = load_game(game_id)
-        if game:
-            games[game_id] = game
-        else:
+    async with game_lock(game_id):
+        game = find_game(game_id)
+        if not game:
             raise HTTPException(status_code=404, detail="Game not found")
-    
-    game = games[game_id]
-    
-    if game.state != GameState.SETUP:
-        raise HTTPException(status_code=400, detail="Game is not in setup phase")
-    
-    ship_sizes = [5, 4, 3, 3, 2]
-    current_ships = len(game.player_board.ships)
-    
-    if current_ships >= len(ship_sizes):
-        raise HTTPException(status_code=400, detail="All ships already placed")
-    
-    expected_size = ship_sizes[current_ships]
-    
-    if not is_valid_ship_placement(game.player_board, request.positions, expected_size):
-        raise HTTPException(status_code=400, detail="Invalid ship placement")
-    
-    place_ship_on_board(game.player_board, request.positions, expected_size)
-    
-    if len(game.player_board.ships) == len(ship_sizes):
-        game.state = GameState.PLAYER_TURN
-        game.current_turn = "player"
-    
-    save_game(game)
-    return {"success": True, "ships_placed": len(game.player_board.ships), "total_ships": len(ship_sizes)}
+        
+        if game.state != GameState.SETUP:
+            raise HTTPException(status_code=400, detail="Game is not in setup phase")
+        
+        current_ships = len(game.player_board.ships)
+        
+        if current_ships >= len(SHIP_SIZES):
+            raise HTTPException(status_code=400, detail="All ships already placed")
+        
+        expected_size = SHIP_SIZES[current_ships]
+        
+        if not is_valid_ship_placement(game.player_board, request.positions, expected_size):
+            raise HTTPException(status_code=400, detail="Invalid ship placement")
+        
+        place_ship_on_board(game.player_board, request.positions, expected_size)
+        
+        if len(game.player_board.ships) == len(SHIP_SIZES):
+            game.state = GameState.PLAYER_TURN
+            game.current_turn = "player"
+        
+        mark_game_dirty(game)
+        return {"success": True, "ships_placed": len(game.player_board.ships), "total_ships": len(SHIP_SIZES)}
 
 @app.post("/game/{game_id}/attack")
 async def attack(game_id: str, request: AttackRequest):
-    if game_id not in games:
-        game = load_game(game_id)
-        if game:
-            games[game_id] = game
-        else:
+    async with game_lock(game_id):
+        game = find_game(game_id)
+        if not game:
             raise HTTPException(status_code=404, detail="Game not found")
-    
-    game = games[game_id]
-    
-    if game.state not in [GameState.PLAYER_TURN, GameState.AI_TURN]:
-        raise HTTPException(status_code=400, detail="Game is not in play phase")
-    
-    if game.current_turn == "player" and game.state == GameState.PLAYER_TURN:
-        if game.ai_board.grid[request.x][request.y] in [CellState.HIT, CellState.MISS]:
-            raise HTTPException(status_code=400, detail="Cell already attacked")
         
-        result = process_attack(game.ai_board, request.x, request.y)
+        if game.state not in [GameState.PLAYER_TURN, GameState.AI_TURN]:
+            raise HTTPException(status_code=400, detail="Game is not in play phase")
         
-        if check_game_over(game.ai_board):
-            game.state = GameState.PLAYER_WON
-        else:
-            game.state = GameState.AI_TURN
-            game.current_turn = "ai"
+        if game.current_turn == "player" and game.state == GameState.PLAYER_TURN:
+            if not (0 <= request.x < 10 and 0 <= request.y < 10):
+                raise HTTPException(status_code=400, detail="Invalid attack coordinates")
+            
+            if game.ai_board.is_attacked(request.x, request.y):
+                raise HTTPException(status_code=400, detail="Cell already attacked")
+            
+            result = process_attack(game.ai_board, request.x, request.y)
+            
+            if check_game_over(game.ai_board):
+                game.state = GameState.PLAYER_WON
+            else:
+                game.state = GameState.AI_TURN
+                game.current_turn = "ai"
+            
+            mark_game_dirty(game)
+            return {"result": result, "game_state": game.state}
         
-        save_game(game)
-        return {"result": result, "game_state": game.state}
-    
-    else:
-        raise HTTPException(status_code=400, detail="Not player's turn")
+        else:
+            raise HTTPException(status_code=400, detail="Not player's turn")
 
 @app.post("/game/{game_id}/ai-turn")
 async def ai_turn(game_id: str):
-    print(f"DEBUG: ai_turn endpoint called for game {game_id}")
+    logger.debug("ai_turn endpoint called for game %s", game_id)
     
     try:
-        if game_id not in games:
-            print(f"DEBUG: Game {game_id} not in memory, trying to load from disk")
-            game = load_game(game_id)
-            if game:
-                games[game_id] = game
-                print(f"DEBUG: Successfully loaded game {game_id} from disk")
-            else:
-                print(f"DEBUG: Game {game_id} not found on disk either")
+        async with game_lock(game_id):
+            game = find_game(game_id)
+            if not game:
+                logger.debug("Game %s not found in memory or on disk", game_id)
                 raise HTTPException(status_code=404, detail="Game session not found. Please start a new game.")
-        
-        game = games[game_id]
-        print(f"DEBUG: Game state: {game.state}, current_turn: {game.current_turn}")
-        
-        if game.state != GameState.AI_TURN or game.current_turn != "ai":
-            print(f"DEBUG: Invalid state for AI turn - state: {game.state}, turn: {game.current_turn}")
-            raise HTTPException(status_code=400, detail=f"It's not the AI's turn. Current game state: {game.state}")
-        
-        print(f"DEBUG: Calling make_ai_move")
-        x, y = make_ai_move(game)
-        print(f"DEBUG: AI chose move ({x}, {y})")
-        
-        if not (0 <= x < 10 and 0 <= y < 10):
-            print(f"DEBUG: ERROR - Invalid AI move coordinates: ({x}, {y})")
-            raise HTTPException(status_code=500, detail="AI generated invalid move coordinates. Please try again.")
-        
-        if game.player_board.grid[x][y] in [CellState.HIT, CellState.MISS]:
-            print(f"DEBUG: ERROR - AI trying to attack already attacked cell: ({x}, {y})")
-            raise HTTPException(status_code=500, detail="AI attempted to attack the same cell twice. Please try again.")
-        
-        print(f"DEBUG: Processing attack on player board at ({x}, {y})")
-        result = process_attack(game.player_board, x, y)
-        print(f"DEBUG: Attack result: {result}")
-        
-        if check_game_over(game.player_board):
-            print(f"DEBUG: Game over - AI won")
-            game.state = GameState.AI_WON
-        else:
-            print(f"DEBUG: Game continues - switching to player turn")
-            game.state = GameState.PLAYER_TURN
-            game.current_turn = "player"
-        
-        print(f"DEBUG: Saving game state")
-        save_game(game)
-        
-        response = {
-            "ai_move": {"x": x, "y": y},
-            "result": result,
-            "game_state": game.state
-        }
-        print(f"DEBUG: Returning response: {response}")
-        return response
+            
+            logger.debug("Game state: %s, current_turn: %s", game.state, game.current_turn)
+            
+            if game.state != GameState.AI_TURN or game.current_turn != "ai":
+                logger.debug("Invalid state for AI turn - state: %s, turn: %s", game.state, game.current_turn)
+                raise HTTPException(status_code=400, detail=f"It's not the AI's turn. Current game state: {game.state}")
+            
+            x, y = make_ai_move(game)
+            logger.debug("AI chose move (%d, %d)", x, y)
+            
+            if not (0 <= x < 10 and 0 <= y < 10):
+                logger.error("Invalid AI move coordinates: (%d, %d)", x, y)
+                raise HTTPException(status_code=500, detail="AI generated invalid move coordinates. Please try again.")
+            
+            if game.player_board.is_attacked(x, y):
+                logger.error("AI trying to attack already attacked cell: (%d, %d)", x, y)
+                raise HTTPException(status_code=500, detail="AI attempted to attack the same cell twice. Please try again.")
+            
+            result = process_attack(game.player_board, x, y)
+            logger.debug("Attack result at (%d, %d): %s", x, y, result)
+            
+            if check_game_over(game.player_board):
+                logger.debug("Game over - AI won")
+                game.state = GameState.AI_WON
+            else:
+                logger.debug("Game continues - switching to player turn")
+                game.state = GameState.PLAYER_TURN
+                game.current_turn = "player"
+            
+            mark_game_dirty(game)
+            
+            response = {
+                "ai_move": {"x": x, "y": y},
+                "result": result,
+                "game_state": game.state
+            }
+            logger.debug("Returning response: %s", response)
+            return response
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"DEBUG: Unexpected exception in ai_turn: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Unexpected exception in ai_turn: %s", e)
         raise HTTPException(status_code=500, detail=f"AI turn failed due to an unexpected error: {str(e)}. Please try refreshing the page or starting a new game.")